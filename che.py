@@ -1,5 +1,7 @@
 import aiohttp
 import asyncio
+import codecs
+import hashlib
 import json
 import os
 import m3u8
@@ -19,6 +21,10 @@ import shutil
 from difflib import SequenceMatcher
 import html
 from datetime import date, timedelta
+from source_cache import (
+    load_state, save_state, conditional_headers, record_digest, cached_body, content_hash,
+    diff_entries, reusable_result, store_result, prune_entries,
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -46,6 +52,8 @@ MAX_TIMEOUT = 30
 RETRIES = 2
 SCRAPER_HEADERS = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'}
 UNWANTED_EXTENSIONS = ['.mkv', '.mp4', '.avi', '.mov', '.flv', '.wmv']
+# Bump when the on-disk index layout changes; older snapshots are refetched
+INDEX_SNAPSHOT_FORMAT = "index-v1"
 
 def channels_to_m3u(channels):
     """Convert a list of channel dictionaries to M3U format string."""
@@ -143,11 +151,122 @@ def save_channels(channels, append=False):
         safe = "".join(c for c in cat if c.isalnum() or c in (' ', '_', '-')).strip()
         save_m3u_file(os.path.join(CATEGORIES_DIR, safe), chs)
 
-async def fetch_json(session, url):
+class UrlIndex(dict):
+    """channel id -> url, projected from logos.json / streams.json (last entry wins)."""
+    __slots__ = ()
+
+    def add(self, item):
+        if item.get("channel"):
+            self[item["channel"]] = item["url"]
+
+    def dump(self):
+        return dict(self)
+
+class ChannelIndex:
+    """Array-backed projection of channels.json: one slot per channel, in feed order."""
+    __slots__ = ("ids", "names", "categories", "countries")
+
+    def __init__(self, data=None):
+        data = data or {}
+        for field in self.__slots__:
+            setattr(self, field, data.get(field, []))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, item):
+        self.ids.append(item.get("id"))
+        self.names.append(item.get("name", "Unknown"))
+        self.categories.append(item.get("categories", ["General"]))
+        self.countries.append(item.get("country", "Unknown"))
+
+    def dump(self):
+        return {field: getattr(self, field) for field in self.__slots__}
+
+async def iter_json_array(response, hasher):
+    """Yield the items of a top-level JSON array as the response body arrives."""
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder("utf-8")()
+    buf, pos = "", 0
+    started = finished = False
+    async for chunk in response.content.iter_chunked(1 << 16):
+        hasher.update(chunk)
+        if finished:
+            continue
+        buf = buf[pos:] + utf8.decode(chunk)
+        pos = 0
+        while True:
+            while pos < len(buf) and buf[pos] in " \t\r\n,":
+                pos += 1
+            if pos >= len(buf):
+                break
+            if not started:
+                if buf[pos] != "[":
+                    raise ValueError(f"expected a JSON array, got {buf[pos]!r}")
+                started = True
+                pos += 1
+                continue
+            if buf[pos] == "]":
+                finished = True
+                break
+            try:
+                item, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break  # item split across chunks; wait for more data
+            yield item
+    if not finished:
+        raise ValueError("truncated or malformed JSON array")
+
+async def fetch_index(session, url, state, index_cls):
+    """Stream a JSON array feed into a compact index.
+
+    The index is kept as the source's cached body, so a 304 loads the
+    snapshot instead of re-downloading. Returns (index, changed).
+    """
+    if state["sources"].get(url, {}).get("format") != INDEX_SNAPSHOT_FORMAT:
+        # No usable snapshot (missing, older layout or corrupt): fetch unconditionally
+        state["sources"].pop(url, None)
+    async with session.get(url, headers=conditional_headers(state, url)) as response:
+        if response.status == 304:
+            index = load_index_snapshot(state, url, index_cls)
+        else:
+            response.raise_for_status()
+            index = index_cls()
+            hasher = hashlib.sha256()
+            async for item in iter_json_array(response, hasher):
+                index.add(item)
+            headers = response.headers
+    if response.status == 304:
+        if index is not None:
+            return index, False
+        # Invalid snapshot: retry unconditionally once the 304 response is released
+        state["sources"].pop(url, None)
+        return await fetch_index(session, url, state, index_cls)
+    body = json.dumps(index.dump(), ensure_ascii=False, separators=(",", ":"))
+    changed = record_digest(state, url, headers, hasher.hexdigest(), body)
+    state["sources"][url]["format"] = INDEX_SNAPSHOT_FORMAT
+    return index, changed
+
+def load_index_snapshot(state, url, index_cls):
+    """Last saved index for url, or None if there is no valid snapshot."""
+    if state["sources"].get(url, {}).get("format") != INDEX_SNAPSHOT_FORMAT:
+        return None
+    body = cached_body(url, state)
+    if body is None:
+        return None
     try:
-        async with session.get(url) as response:
-            return await response.json()
-    except: return []
+        data = json.loads(body)
+        if not isinstance(data, dict):
+            raise ValueError(f"expected an object, got {type(data).__name__}")
+        return index_cls(data)
+    except (ValueError, TypeError, AttributeError) as e:
+        logging.error(f"Discarding invalid snapshot of {url}: {e!r}")
+        return None
+
+def channel_fingerprint(record):
+    return content_hash(json.dumps(
+        [record["name"], record["logo"], record["url"], record["categories"], record["country"]],
+        sort_keys=True, ensure_ascii=False))
 
 class FastChecker:
     def __init__(self):
@@ -165,36 +284,73 @@ async def main():
     logging.info("Starting IPTV Scraper (M3U Output)...")
     checker = FastChecker()
     async with aiohttp.ClientSession(connector=TCPConnector(limit=MAX_CONCURRENT, ssl=False)) as session:
-        logos_data = await fetch_json(session, LOGOS_URL)
-        logos_dict = {l["channel"]: l["url"] for l in logos_data if l.get("channel")}
-        
-        # IPTV-org logic
-        channels_data = await fetch_json(session, CHANNELS_URL)
-        streams_data = await fetch_json(session, STREAMS_URL)
-        streams_dict = {s["channel"]: s for s in streams_data if s.get("channel")}
+        state = load_state("che")
+        feeds = [(LOGOS_URL, UrlIndex), (CHANNELS_URL, ChannelIndex), (STREAMS_URL, UrlIndex)]
+        results = await asyncio.gather(
+            *[fetch_index(session, url, state, index_cls) for url, index_cls in feeds],
+            return_exceptions=True)
+
+        indexes = []
+        any_changed = False
+        for (url, index_cls), result in zip(feeds, results):
+            if isinstance(result, Exception):
+                logging.error(f"Failed to fetch {url}: {result!r}")
+                index = load_index_snapshot(state, url, index_cls)
+                if index is not None:
+                    logging.warning(f"Using last snapshot of {url}")
+                indexes.append(index)
+            else:
+                index, feed_changed = result
+                any_changed = any_changed or feed_changed
+                indexes.append(index)
+        logos, channels, streams = indexes
+        if channels is None or streams is None:
+            logging.error("Channel or stream data unavailable; keeping previous results.")
+            return
+        if logos is None:
+            logos = UrlIndex()
+        if not any_changed:
+            logging.info("Upstream sources unchanged since last run.")
         
         working_channels = []
         # Limit processing for efficiency in this example
-        to_process = channels_data[:500] 
-
-        async def process_one(ch):
-            ch_id = ch.get("id")
-            if ch_id in streams_dict:
-                url = streams_dict[ch_id]["url"]
-                async with checker.semaphore:
-                    if await checker.check_url(session, url):
-                        working_channels.append({
-                            "name": ch.get("name", "Unknown"),
-                            "id": ch_id,
-                            "logo": logos_dict.get(ch_id, ""),
-                            "url": url,
-                            "categories": ch.get("categories", ["General"]),
-                            "country": ch.get("country", "Unknown")
-                        })
-
-        logging.info(f"Checking {len(to_process)} channels...")
-        await asyncio.gather(*[process_one(ch) for ch in to_process])
+        records = {}
+        for i in range(min(len(channels), 500)):
+            ch_id = channels.ids[i]
+            if ch_id in streams:
+                records[ch_id] = {
+                    "name": channels.names[i],
+                    "id": ch_id,
+                    "logo": logos.get(ch_id, ""),
+                    "url": streams[ch_id],
+                    "categories": channels.categories[i],
+                    "country": channels.countries[i]
+                }
+        fingerprints = {ch_id: channel_fingerprint(r) for ch_id, r in records.items()}
+        added_ids, changed_ids, removed_ids = diff_entries(state, fingerprints)
+        logging.info(f"Entry diff: {len(added_ids)} added, {len(changed_ids)} changed, {len(removed_ids)} removed")
+
+        to_check = []
+        for ch_id, record in records.items():
+            cached = reusable_result(state, ch_id, fingerprints[ch_id])
+            if cached is None:
+                to_check.append(ch_id)
+            elif cached["ok"]:
+                working_channels.append(record)
+
+        async def process_one(ch_id):
+            record = records[ch_id]
+            async with checker.semaphore:
+                ok = await checker.check_url(session, record["url"])
+            store_result(state, ch_id, fingerprints[ch_id], ok)
+            if ok:
+                working_channels.append(record)
+
+        logging.info(f"Checking {len(to_check)} channels ({len(records) - len(to_check)} reused)...")
+        await asyncio.gather(*[process_one(ch_id) for ch_id in to_check])
         
+        prune_entries(state, records)
+        save_state("che", state)
         save_channels(working_channels)
         logging.info(f"Process completed. Found {len(working_channels)} channels.")
 
@@ -1,5 +1,10 @@
 import os
+import json
 import requests
+from source_cache import (
+    CACHE_DIR, load_state, save_state, conditional_headers, record_source, content_hash,
+    entry_keys, diff_entries, reusable_result, store_result, prune_entries,
+)
 #https://github.com/iprtl/m3u/raw/b8507db8229defeda88512eaaf66bfe0e385e81c/Freetv.m3u
 # URLs dos repositórios que contêm os arquivos M3U
 repo_urls = [
@@ -7,45 +12,75 @@ repo_urls = [
 ]
 
 lists = []
+output_file = "lista1.M3U"
+# Mesclagem completa (antes da checagem), reaproveitada enquanto as fontes não mudam
+merged_file = os.path.join(CACHE_DIR, "downlist_merged.M3U")
+
+# Estado persistido (ETag/Last-Modified + hash) de cada fonte
+state = load_state("downlist")
+changed_sources = []
+
+def get_cached(url):
+    """GET condicional; em 304 reaproveita o corpo salvo da execução anterior.
+
+    Retorna (status, texto, content-type).
+    """
+    response = requests.get(url, allow_redirects=True, headers=conditional_headers(state, url))
+    if response.status_code not in (200, 304):
+        return response.status_code, None, ""
+    text, changed = record_source(state, url, response.status_code, response.headers, response.text)
+    if text is None:
+        # 304 sem corpo salvo: baixa de novo sem cabeçalhos condicionais
+        response = requests.get(url, allow_redirects=True)
+        if response.status_code != 200:
+            return response.status_code, None, ""
+        text, changed = record_source(state, url, 200, response.headers, response.text)
+    if changed:
+        changed_sources.append(url)
+    else:
+        print(f"  Sem alterações desde a última execução: {url}")
+    content_type = state["sources"][url].get("content_type", "")
+    if response.status_code == 200:
+        content_type = response.headers.get('content-type', '').lower()
+        state["sources"][url]["content_type"] = content_type
+    return 200, text, content_type
 
 # Buscar arquivos M3U de cada URL
 for url in repo_urls:
     print(f"Processando URL: {url}")
     try:
-        response = requests.get(url, allow_redirects=True)
+        status_code, text, content_type = get_cached(url)
 
-        if response.status_code == 200:
-            content_type = response.headers.get('content-type', '').lower()
-            
-            if url.lower().endswith(('.m3u', '.m3u8')) or '#EXTM3U' in response.text:
+        if status_code == 200:
+            if url.lower().endswith(('.m3u', '.m3u8')) or '#EXTM3U' in text:
                 print(f"  Detectado arquivo M3U direto: {url}")
                 filename = url.split("/")[-1]
-                lists.append((filename, response.text))
+                lists.append((filename, text))
             elif 'application/json' in content_type:
                 try:
-                    contents = response.json()
+                    contents = json.loads(text)
                     print(f"  Processando resposta JSON com {len(contents)} itens")
                     m3u_files = [content for content in contents if content.get("name", "").lower().endswith(('.m3u', '.m3u8'))]
 
                     for m3u_file in m3u_files:
                         m3u_url = m3u_file["download_url"]
                         print(f"  Baixando arquivo M3U: {m3u_url}")
-                        m3u_response = requests.get(m3u_url, allow_redirects=True)
-                        if m3u_response.status_code == 200:
-                            lists.append((m3u_file["name"], m3u_response.text))
+                        m3u_status, m3u_text, _ = get_cached(m3u_url)
+                        if m3u_status == 200:
+                            lists.append((m3u_file["name"], m3u_text))
                 except ValueError:
                     print(f"  Erro ao processar JSON de {url}, tratando como arquivo M3U direto")
                     filename = url.split("/")[-1]
-                    lists.append((filename, response.text))
+                    lists.append((filename, text))
             else:
-                if '#EXTM3U' in response.text:
+                if '#EXTM3U' in text:
                     print(f"  Conteúdo detectado como M3U pelo cabeçalho #EXTM3U")
                     filename = url.split("/")[-1]
-                    lists.append((filename, response.text))
+                    lists.append((filename, text))
                 else:
                     print(f"  Tipo de conteúdo não reconhecido: {content_type}")
         else:
-            print(f"  Erro ao acessar URL: {url}, código de status: {response.status_code}")
+            print(f"  Erro ao acessar URL: {url}, código de status: {status_code}")
     except requests.exceptions.RequestException as e:
         print(f"  Erro ao processar URL {url}: {e}")
 
@@ -56,9 +91,26 @@ print(f"\nTotal de listas M3U encontradas: {len(lists)}")
 for name, _ in lists:
     print(f"  - {name}")
 
+# Fontes que já foram mescladas antes e não aparecem mais também invalidam a saída
+merged_sources = sorted(name for name, _ in lists)
+if merged_sources != state.get("merged_sources"):
+    changed_sources.append("(conjunto de listas)")
+
+def merged_file_hash():
+    try:
+        with open(merged_file, encoding="utf-8", errors="ignore") as f:
+            return content_hash(f.read())
+    except OSError:
+        return None
+
+# A mesclagem só vale se for a mesma registrada no estado salvo (uma execução
+# interrompida pode ter deixado um arquivo mais novo que o estado)
+merge_needed = bool(changed_sources) or merged_file_hash() != state.get("merged_sha256")
+if not merge_needed:
+    print(f"\nNenhuma fonte mudou; mesclagem anterior reaproveitada ({merged_file}).")
+
 # Limitação das linhas a serem escritas no arquivo final
 line_count = 0
-output_file = "lista1.M3U"
 wrote_header = False  # Para garantir que só escreva uma vez o cabeçalho
 epg_urls = []  # Lista para armazenar URLs de EPG encontradas
 
@@ -90,53 +142,58 @@ def is_simple_extm3u_header(line):
     
     return True
 
-with open(output_file, "w") as f:
-    for list_name, list_content in lists:
-        print(f"Processando lista: {list_name}")
-        lines = list_content.split("\n")
+if merge_needed:
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    with open(merged_file + ".tmp", "w") as f:
+        for list_name, list_content in lists:
+            print(f"Processando lista: {list_name}")
+            lines = list_content.split("\n")
 
-        start_idx = 0
-
-        # Verifica se a primeira linha é um cabeçalho #EXTM3U
-        if lines and lines[0].strip().startswith("#EXTM3U"):
-            if not wrote_header:
-                f.write(lines[0].strip() + "\n")
-                line_count += 1
-                wrote_header = True
+            start_idx = 0
 
-                epg_url = extract_epg_url(lines[0])
-                if epg_url and epg_url not in epg_urls:
-                    epg_urls.append(epg_url)
-                    print(f"  URL de EPG encontrada: {epg_url}")
-
-            start_idx = 1
-
-        for i in range(start_idx, len(lines)):
-            line = lines[i].strip()
-            if not line:
-                continue
+            # Verifica se a primeira linha é um cabeçalho #EXTM3U
+            if lines and lines[0].strip().startswith("#EXTM3U"):
+                if not wrote_header:
+                    f.write(lines[0].strip() + "\n")
+                    line_count += 1
+                    wrote_header = True
 
-            if line.startswith("#EXTM3U"):
-                if is_simple_extm3u_header(line):
-                    continue
-                else:
-                    epg_url = extract_epg_url(line)
+                    epg_url = extract_epg_url(lines[0])
                     if epg_url and epg_url not in epg_urls:
                         epg_urls.append(epg_url)
                         print(f"  URL de EPG encontrada: {epg_url}")
 
-                    f.write(line + "\n")
-                    line_count += 1
+                start_idx = 1
+
+            for i in range(start_idx, len(lines)):
+                line = lines[i].strip()
+                if not line:
                     continue
 
-            f.write(line + "\n")
-            line_count += 1
+                if line.startswith("#EXTM3U"):
+                    if is_simple_extm3u_header(line):
+                        continue
+                    else:
+                        epg_url = extract_epg_url(line)
+                        if epg_url and epg_url not in epg_urls:
+                            epg_urls.append(epg_url)
+                            print(f"  URL de EPG encontrada: {epg_url}")
+
+                        f.write(line + "\n")
+                        line_count += 1
+                        continue
+
+                f.write(line + "\n")
+                line_count += 1
 
+    os.replace(merged_file + ".tmp", merged_file)
+    state["merged_sources"] = merged_sources
+    state["merged_sha256"] = merged_file_hash()
 
-print(f"\nArquivo {output_file} criado com {line_count} linhas")
-print(f"URLs de EPG encontradas e preservadas:")
-for epg_url in epg_urls:
-    print(f"  - {epg_url}")
+    print(f"\nArquivo {merged_file} criado com {line_count} linhas")
+    print(f"URLs de EPG encontradas e preservadas:")
+    for epg_url in epg_urls:
+        print(f"  - {epg_url}")
 
 
 
@@ -206,12 +263,12 @@ def search_google_images(query):
 # =========================
 # PROCESSAMENTO FINAL
 # =========================
-def process_m3u_file(input_file, output_file):
+def process_m3u_file(input_file, output_file, state):
     with open(input_file, encoding="utf-8", errors="ignore") as f:
         lines = f.readlines()
 
     extm3u_headers = []
-    channels = []
+    entries = []
 
     i = 0
     while i < len(lines):
@@ -224,7 +281,6 @@ def process_m3u_file(input_file, output_file):
             continue
 
         if line.startswith("#EXTINF"):
-            name, group, tvg_id, logo = parse_extinf_line(line)
             extras = []
             link = None
 
@@ -237,22 +293,49 @@ def process_m3u_file(input_file, output_file):
                     link = nxt
                     break
 
-            if link and check_url(link):
-                if logo in ["Undefined.png", "", "N/A"]:
-                    found_logo = search_google_images(name)
-                    logo = found_logo if found_logo else logo
-
-                channels.append({
-                    "name": name,
-                    "group": group,
-                    "tvg_id": tvg_id,
-                    "logo": logo,
-                    "url": link,
-                    "extra": extras
-                })
+            if link:
+                entries.append((line, extras, link))
 
         i += 1
 
+    # Só entradas novas, alteradas ou com checagem expirada são checadas de novo
+    keys = entry_keys(link for _, _, link in entries)
+    fingerprints = {
+        key: content_hash("\n".join([extinf] + extras))
+        for key, (extinf, extras, _) in zip(keys, entries)
+    }
+    added, modified, removed = diff_entries(state, fingerprints)
+    print(f"Novas: {len(added)}, alteradas: {len(modified)}, removidas: {len(removed)}")
+
+    channels = []
+    reused = 0
+    for key, (extinf, extras, link) in zip(keys, entries):
+        name, group, tvg_id, logo = parse_extinf_line(extinf)
+        cached = reusable_result(state, key, fingerprints[key])
+        if cached is not None:
+            reused += 1
+            ok = cached["ok"]
+            logo = cached.get("logo") or logo
+        else:
+            ok = check_url(link)
+            if ok and logo in ["Undefined.png", "", "N/A"]:
+                found_logo = search_google_images(name)
+                logo = found_logo if found_logo else logo
+            store_result(state, key, fingerprints[key], ok, logo=logo)
+
+        if ok:
+            channels.append({
+                "name": name,
+                "group": group,
+                "tvg_id": tvg_id,
+                "logo": logo,
+                "url": link,
+                "extra": extras
+            })
+
+    prune_entries(state, fingerprints)
+    print(f"Reaproveitadas: {reused}, checadas: {len(entries) - reused}")
+
     with open(output_file, "w", encoding="utf-8") as f:
         for h in extm3u_headers:
             f.write(h + "\n")
@@ -276,7 +359,9 @@ def process_m3u_file(input_file, output_file):
 # =========================
 # EXECUÇÃO
 # =========================
-process_m3u_file("lista1.M3U", "lista1.M3U")
+process_m3u_file(merged_file, output_file, state)
+# Só depois da checagem: uma execução interrompida refaz mesclagem e checagem
+save_state("downlist", state)
 
 print("Processamento concluído ✔")
 
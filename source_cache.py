@@ -0,0 +1,168 @@
+import hashlib
+import json
+import os
+import time
+
+# Diretório persistido entre execuções (restaurado pelo actions/cache nos workflows)
+CACHE_DIR = os.getenv("SOURCE_CACHE_DIR", ".source_cache")
+# Idade máxima (em horas) para reaproveitar o resultado de uma checagem anterior
+RECHECK_MAX_AGE = float(os.getenv("RECHECK_MAX_AGE", 24))
+
+
+def content_hash(data):
+    """SHA-256 de um texto ou bytes."""
+    if isinstance(data, str):
+        data = data.encode("utf-8", errors="ignore")
+    return hashlib.sha256(data).hexdigest()
+
+
+def _state_path(name):
+    return os.path.join(CACHE_DIR, f"{name}.json")
+
+
+def _body_path(url):
+    return os.path.join(CACHE_DIR, "bodies", content_hash(url))
+
+
+def load_state(name):
+    """Carrega o estado salvo de um script ({"sources": {...}, "entries": {...}})."""
+    try:
+        with open(_state_path(name), encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+    state.setdefault("sources", {})
+    state.setdefault("entries", {})
+    return state
+
+
+def save_state(name, state):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp = _state_path(name) + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp, _state_path(name))
+
+
+def conditional_headers(state, url):
+    """Cabeçalhos If-None-Match/If-Modified-Since da última resposta desta URL."""
+    meta = state["sources"].get(url)
+    headers = {}
+    if meta and os.path.exists(_body_path(url)):
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    return headers
+
+
+def cached_body(url, state=None):
+    """Corpo salvo da URL, ou None se não existir.
+
+    Com `state`, o corpo também precisa bater com o hash registrado: uma
+    execução interrompida pode ter gravado um corpo mais novo que o estado.
+    """
+    try:
+        with open(_body_path(url), encoding="utf-8") as f:
+            body = f.read()
+    except OSError:
+        return None
+    if state is not None:
+        expected = state["sources"].get(url, {}).get("body_sha256")
+        if expected and content_hash(body) != expected:
+            return None
+    return body
+
+
+def record_source(state, url, status, headers, text):
+    """Atualiza o estado de uma fonte após a resposta HTTP.
+
+    Retorna (texto, mudou). Em 304 o corpo salvo anteriormente é reaproveitado.
+    """
+    if status == 304:
+        body = cached_body(url, state)
+        if body is not None:
+            return body, False
+        # Corpo perdido: trata como fonte nova na próxima execução
+        state["sources"].pop(url, None)
+        return None, True
+
+    return text, record_digest(state, url, headers, content_hash(text), text)
+
+
+def record_digest(state, url, headers, digest, body):
+    """Como record_source, para respostas lidas em streaming.
+
+    `digest` é o hash do payload original; `body` é o que fica salvo para
+    ser devolvido em 304 (por exemplo, uma projeção compacta do JSON).
+    Retorna True se o conteúdo mudou.
+    """
+    meta = state["sources"].get(url, {})
+    changed = digest != meta.get("sha256")
+    if changed or not os.path.exists(_body_path(url)):
+        os.makedirs(os.path.dirname(_body_path(url)), exist_ok=True)
+        tmp = _body_path(url) + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(body)
+        os.replace(tmp, _body_path(url))
+    state["sources"][url] = {
+        "etag": headers.get("ETag"),
+        "last_modified": headers.get("Last-Modified"),
+        "sha256": digest,
+        "body_sha256": content_hash(body),
+    }
+    return changed
+
+
+def entry_keys(urls):
+    """Chave estável por entrada: a URL, mais a posição entre as repetições dela.
+
+    Assim a mesma URL listada várias vezes não disputa um único fingerprint.
+    """
+    seen = {}
+    keys = []
+    for url in urls:
+        n = seen.get(url, 0)
+        seen[url] = n + 1
+        keys.append(f"{url} #{n}" if n else url)
+    return keys
+
+
+def diff_entries(state, fingerprints):
+    """Compara {chave: fingerprint} com o snapshot anterior.
+
+    Retorna (adicionadas, alteradas, removidas) como conjuntos de chaves.
+    """
+    previous = state["entries"]
+    added = {k for k in fingerprints if k not in previous}
+    changed = {
+        k for k, fp in fingerprints.items()
+        if k in previous and previous[k].get("fingerprint") != fp
+    }
+    removed = set(previous) - set(fingerprints)
+    return added, changed, removed
+
+
+def reusable_result(state, key, fingerprint):
+    """Resultado anterior da entrada se ela não mudou e ainda não expirou."""
+    entry = state["entries"].get(key)
+    if not entry or entry.get("fingerprint") != fingerprint:
+        return None
+    if time.time() - entry.get("checked", 0) > RECHECK_MAX_AGE * 3600:
+        return None
+    return entry
+
+
+def store_result(state, key, fingerprint, ok, **extra):
+    state["entries"][key] = {
+        "fingerprint": fingerprint,
+        "ok": ok,
+        "checked": time.time(),
+        **extra,
+    }
+
+
+def prune_entries(state, keys):
+    """Remove do snapshot as entradas que sumiram das fontes."""
+    for key in set(state["entries"]) - set(keys):
+        del state["entries"][key]
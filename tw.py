@@ -1,6 +1,10 @@
 import aiohttp
 import asyncio
 import logging
+from source_cache import (
+    load_state, save_state, conditional_headers, record_source, content_hash,
+    entry_keys, diff_entries, reusable_result, store_result, prune_entries,
+)
 
 M3U_INPUT_URL = "https://github.com/LITUATUI/M3UPT/raw/fdbf3b5fb4728c0647b8918aa6048be2532bf987/M3U/M3UPT.m3u"
 OUTPUT_FILE = "lista2.m3u"
@@ -28,10 +32,18 @@ class FastChecker:
         return False
 
 
-async def fetch_m3u(session):
-    async with session.get(M3U_INPUT_URL) as r:
-        r.raise_for_status()
-        return await r.text()
+async def fetch_m3u(session, state):
+    async with session.get(M3U_INPUT_URL, headers=conditional_headers(state, M3U_INPUT_URL)) as r:
+        if r.status != 304:
+            r.raise_for_status()
+        text = None if r.status == 304 else await r.text()
+        content, changed = record_source(state, M3U_INPUT_URL, r.status, r.headers, text)
+    if content is None:
+        # 304 sem corpo salvo: baixa de novo sem cabeçalhos condicionais
+        async with session.get(M3U_INPUT_URL) as r:
+            r.raise_for_status()
+            content, changed = record_source(state, M3U_INPUT_URL, 200, r.headers, await r.text())
+    return content, changed
 
 
 def parse_m3u(content):
@@ -53,25 +65,46 @@ async def main():
     checker = FastChecker()
     timeout = aiohttp.ClientTimeout(total=TIMEOUT)
 
+    state = load_state("tw")
+
     async with aiohttp.ClientSession(timeout=timeout) as session:
         logging.info("Baixando M3U...")
-        content = await fetch_m3u(session)
+        content, changed = await fetch_m3u(session, state)
+        if not changed:
+            logging.info("M3U sem alterações desde a última execução")
 
         channels = parse_m3u(content)
         logging.info(f"Total de canais encontrados: {len(channels)}")
 
-        working = []
+        keys = entry_keys(url for _, url in channels)
+        fingerprints = {key: content_hash(extinf) for key, (extinf, _) in zip(keys, channels)}
+        added, modified, removed = diff_entries(state, fingerprints)
+        logging.info(f"Novos: {len(added)}, alterados: {len(modified)}, removidos: {len(removed)}")
 
-        async def test_channel(extinf, url):
+        working = []
+        to_test = []
+        for key, (extinf, url) in zip(keys, channels):
+            cached = reusable_result(state, key, fingerprints[key])
+            if cached is None:
+                to_test.append((key, extinf, url))
+            elif cached["ok"]:
+                working.append((extinf, url))
+        logging.info(f"Reaproveitados: {len(channels) - len(to_test)}, a testar: {len(to_test)}")
+
+        async def test_channel(key, extinf, url):
             async with checker.semaphore:
                 ok = await checker.check(session, url)
+                store_result(state, key, fingerprints[key], ok)
                 if ok:
                     logging.info(f"OK: {url}")
                     working.append((extinf, url))
 
-        tasks = [test_channel(extinf, url) for extinf, url in channels]
+        tasks = [test_channel(key, extinf, url) for key, extinf, url in to_test]
         await asyncio.gather(*tasks)
 
+    prune_entries(state, fingerprints)
+    save_state("tw", state)
+
     logging.info(f"Canais funcionando: {len(working)}")
 
     with open(OUTPUT_FILE, "w", encoding="utf-8") as f: